@@ -1,30 +1,223 @@
 import os
-from flask import Flask, request, abort, jsonify
+import logging
+from urllib.parse import urlencode
+from uuid import uuid4
+from flask import Flask, request, abort, jsonify, has_app_context
+from flask.json import JSONEncoder
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
-import random
+from flask_caching import Cache
+from sqlalchemy import Integer, all_, bindparam, event, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.pool import NullPool
+import orjson
+from redis.exceptions import RedisError
 
-from backend.models import setup_db, Question, Category
+from backend.models import setup_db, db, Question, Category
 
 QUESTIONS_PER_PAGE = 10
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+
+cache = Cache()
+
+logger = logging.getLogger(__name__)
+
+
+class ORJSONEncoder(JSONEncoder):
+  '''
+  Encodes responses with orjson. Output is raw UTF-8, keys are sorted as
+  strings and pretty printing always indents by 2. Dates and dataclasses
+  still go through Flask's default().
+  '''
+
+  def encode(self, o):
+
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    if self.sort_keys:
+      option |= orjson.OPT_SORT_KEYS
+
+    if self.indent is not None:
+      option |= orjson.OPT_INDENT_2
+
+    return orjson.dumps(o, default=self.default, option=option).decode('utf-8')
 
-def paginate_questions(request, selection):
 
+def get_page_position(request):
+
+  after_id = request.args.get('after_id', type=int)
   page = request.args.get('page', 1, type=int)
 
-  start = (page - 1) * QUESTIONS_PER_PAGE
-  end = start + QUESTIONS_PER_PAGE
+  if page < 1:
+    abort(404)
+
+  return after_id, (page - 1) * QUESTIONS_PER_PAGE
+
+
+def paginate_questions(request, selection):
+
+  after_id, start = get_page_position(request)
+
+  # one extra row tells whether another page follows
+  if after_id is not None:
+    # a window count here would only cover the rows past the cursor
+    questions = selection.with_entities(*QUESTION_COLUMNS).filter(Question.id > after_id).limit(QUESTIONS_PER_PAGE + 1).all()
+    total_questions = None
+  else:
+    questions = selection.with_entities(*QUESTION_COLUMNS, func.count().over().label('total')).limit(QUESTIONS_PER_PAGE + 1).offset(start).all()
+    total_questions = questions[0].total if questions else None
+
+  if total_questions is None:
+    total_questions = count_questions(selection)
+
+  next_cursor = questions[QUESTIONS_PER_PAGE - 1].id if len(questions) > QUESTIONS_PER_PAGE else None
+  current_questions = [question._asdict() for question in questions[:QUESTIONS_PER_PAGE]]
+
+  for question in current_questions:
+    question.pop('total', None)
+
+  return current_questions, total_questions, next_cursor
+
+
+def count_questions(selection):
+
+  return selection.order_by(None).with_entities(func.count(Question.id)).scalar()
+
+
+'''
+Cache helpers. A cache outage is logged and treated as a miss.
+'''
+
+def cache_get(key):
+
+  try:
+    return cache.get(key)
+  except RedisError:
+    logger.exception("Exception possibly due to cache backend.")
+    return None
+
+
+def cache_set(key, value, timeout=None):
+
+  try:
+    cache.set(key, value, timeout=timeout)
+  except RedisError:
+    logger.exception("Exception possibly due to cache backend.")
+
+
+def cache_delete(key):
+
+  try:
+    cache.delete(key)
+  except RedisError:
+    logger.exception("Exception possibly due to cache backend.")
+
+
+def get_cache_version():
+
+  version = cache_get('version')
+
+  if version is None:
+    version = uuid4().hex
+    cache_set('version', version, timeout=0)
+
+  return version
+
+
+def invalidate_cache():
+  '''
+  Moves cached views to a new version, which orphans the old entries
+  until they expire, and drops the known data keys.
+  '''
+  cache_set('version', uuid4().hex, timeout=0)
+  cache_delete('categories')
+
+
+def make_view_cache_key(*args, **kwargs):
 
-  questions = [question.format() for question in selection]
-  current_questions = questions[start:end]
+  query = urlencode(sorted(request.args.items(multi=True)))
 
-  return current_questions
+  return 'view/{}{}?{}'.format(get_cache_version(), request.path, query)
+
+
+def get_categories():
+
+  categories = cache_get('categories')
+
+  if categories is None:
+    categories = dict(Category.query.with_entities(Category.id, Category.type).order_by(Category.id).all())
+    cache_set('categories', categories, timeout=300)
+
+  return categories
+
+
+'''
+ORM writes mark the session, and the cache is invalidated once the
+transaction commits rather than in the middle of a flush.
+'''
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+@event.listens_for(Question, 'after_delete')
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def mark_cache_stale(mapper, connection, target):
+
+  object_session(target).info['cache_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_stale_cache(session):
+
+  # without an app there is no cache to invalidate, e.g. in scripts
+  if session.info.pop('cache_stale', False) and has_app_context():
+    invalidate_cache()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_stale_mark(session):
+
+  session.info.pop('cache_stale', None)
 
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
+  app.json_encoder = ORJSONEncoder
+  app.config['JSON_AS_ASCII'] = False
+
+  '''
+  Keep warm database connections ready for concurrent requests.
+  Behind pgbouncer, pooling is delegated to it instead.
+  '''
+  if os.environ.get('USE_PGBOUNCER'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+      'poolclass': NullPool
+    }
+  else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+      'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+      'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+      'pool_pre_ping': True,
+      'pool_recycle': 1800
+    }
+
+  '''
+  Cache responses of the GET endpoints in Redis. Writes invalidate the cache.
+  '''
+  app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'RedisCache')
+  app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+  app.config['CACHE_KEY_PREFIX'] = 'trivia_'
+  app.config['CACHE_DEFAULT_TIMEOUT'] = 60
+
+  if test_config is not None:
+    app.config.update(test_config)
+
   setup_db(app)
+  cache.init_app(app)
 
   app.config['SECRET_KEY'] = 'dev'
   app.config['CORS_HEADERS'] = 'Content-Type'
@@ -35,33 +228,22 @@ def create_app(test_config=None):
   CORS(app, resources={r"/.*": {"origins":"*"}})
 
 
-  '''
-  Use the after_request decorator to set Access-Control-Allow headers
-  '''
-  @app.after_request
-  def after_request(response):
-
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE, OPTIONS')
-
-    return response
-
-
   '''
   Endpoint to GET all available categories.
   '''
 
   @app.route("/categories")
+  @cache.cached(timeout=300, make_cache_key=make_view_cache_key)
   def retrieve_categories():
 
-    categories = Category.query.order_by(Category.type).all()
+    categories = get_categories()
 
     if len(categories) == 0:
       abort(404)
 
     return jsonify({
       "success": True,
-      "categories": {category.id : category.type for category in categories}
+      "categories": categories
     })
 
 
@@ -73,12 +255,11 @@ def create_app(test_config=None):
   '''
 
   @app.route('/questions')
+  @cache.cached(timeout=60, make_cache_key=make_view_cache_key)
   def retrieve_questions():
 
-    questions = Question.query.order_by(Question.id).all()
-    current_questions = paginate_questions(request, questions)
-
-    categories = Category.query.order_by(Category.id).all()
+    questions = Question.query.order_by(Question.id)
+    current_questions, total_questions, next_cursor = paginate_questions(request, questions)
 
     if len(current_questions) == 0:
       abort(404)
@@ -86,8 +267,9 @@ def create_app(test_config=None):
     return jsonify({
       "success": True,
       "questions": current_questions,
-      "total_questions": len(questions),
-      "categories": {category.id: category.type for category in categories},
+      "total_questions": total_questions,
+      "next_cursor": next_cursor,
+      "categories": get_categories(),
       "currentCategory": None
     })
 
@@ -100,15 +282,21 @@ def create_app(test_config=None):
   def delete_question(question_id):
 
     try:
-      question_obj = Question.query.filter(Question.id == question_id).one()
-      print(question_obj.format())
-      question_obj.delete()
+      result = db.session.execute(Question.__table__.delete().where(Question.id == question_id).returning(Question.id))
+      deleted = result.first()
+      db.session.commit()
+
+      if deleted is None:
+        abort(404)
+
+      invalidate_cache()
 
       return jsonify({
         "success": True,
-        "deleted": question_id
+        "deleted": deleted[0]
       })
-    except:
+    except SQLAlchemyError:
+      db.session.rollback()
       abort(422)
 
 
@@ -136,17 +324,13 @@ def create_app(test_config=None):
       question_obj = Question(question_val, answer_val, category_val, difficulty_val)
       question_obj.insert()
 
-      questions = Question.query.order_by(Question.id).all()
-      current_questions = paginate_questions(request, questions)
-
       return jsonify({
         "success": True,
         "created": question_obj.id,
-        "questions": current_questions,
-        "total_questions": len(questions)
+        "total_questions": count_questions(Question.query)
       })
-    except:
-      question_obj.rollback()
+    except SQLAlchemyError:
+      db.session.rollback()
       abort(422)
 
 
@@ -163,17 +347,26 @@ def create_app(test_config=None):
 
     if search_term:
 
-      questions_obj = Question.query.filter(Question.question.ilike("%" + search_term + "%")).all()
+      search_vector = func.to_tsvector('english', Question.question)
+      search_query = func.plainto_tsquery('english', search_term)
 
-      if not questions_obj:
-        abort(404)
+      questions_obj = Question.query.filter(search_vector.op('@@')(search_query)).order_by(Question.id)
+
+      if not db.session.query(questions_obj.order_by(None).exists()).scalar():
+        # fall back to a substring match for partial words the full-text search does not tokenize
+        search_pattern = bindparam('search_pattern', '%{}%'.format(search_term))
+        questions_obj = Question.query.filter(Question.question.ilike(search_pattern)).order_by(Question.id)
+
+      current_questions, total_questions, next_cursor = paginate_questions(request, questions_obj)
 
-      current_questions = paginate_questions(request, questions_obj)
+      if len(current_questions) == 0:
+        abort(404)
 
       return jsonify({
         "success": True,
         "questions": current_questions,
-        "total_questions": len(questions_obj),
+        "total_questions": total_questions,
+        "next_cursor": next_cursor,
         "current_category": None
       })
     else:
@@ -185,27 +378,28 @@ def create_app(test_config=None):
   '''
 
   @app.route("/categories/<int:category_id>/questions", methods=["GET"])
+  @cache.cached(timeout=60, make_cache_key=make_view_cache_key)
   def retrieve_questions_by_category(category_id):
 
     try:
 
-      category_ids = [cat.id for cat in Category.query.with_entities(Category.id, Category.type).order_by(Category.id).all()]
-
-      if category_id not in category_ids:
+      if category_id not in get_categories():
         abort(404)
 
-      questions_obj = Question.query.filter(Question.category == str(category_id)).all()
-      current_questions = paginate_questions(request, questions_obj)
+      questions_obj = Question.query.filter(Question.category == category_id).order_by(Question.id)
+      current_questions, total_questions, next_cursor = paginate_questions(request, questions_obj)
 
 
       return jsonify({
         "success": True,
         "questions": current_questions,
-        "total_questions": len(questions_obj),
+        "total_questions": total_questions,
+        "next_cursor": next_cursor,
         "currentCategory": category_id
       })
-    except:
-      abort(404)
+    except SQLAlchemyError:
+      db.session.rollback()
+      abort(422)
 
 
 
@@ -229,19 +423,28 @@ def create_app(test_config=None):
       previous_questions = body.get('previous_questions')
       quiz_category = body.get('quiz_category')
 
-      if quiz_category['type'] == 'click':
-        available_questions = Question.query.filter(Question.id.notin_((previous_questions))).all()
-      else:
-        available_questions = Question.query.filter(Question.category == quiz_category['id']).filter(Question.id.notin_((previous_questions))).all()
+      if not isinstance(previous_questions, list):
+        abort(422)
+
+      # a single array parameter keeps the statement the same however many questions were asked
+      previous_ids = bindparam('previous_questions', previous_questions, type_=ARRAY(Integer))
+      available_questions = Question.query.filter(Question.id != all_(previous_ids))
 
-      question = available_questions[random.randrange(0, len(available_questions))].format() if len(available_questions) > 0 else None
+      if quiz_category['type'] != 'click':
+        available_questions = available_questions.filter(Question.category == quiz_category['id'])
+
+      question_obj = available_questions.order_by(func.random()).limit(1).first()
+      question = question_obj.format() if question_obj else None
 
       return jsonify({
         'success': True,
         'question': question
       })
 
-    except:
+    except (KeyError, TypeError):
+      abort(422)
+    except SQLAlchemyError:
+      db.session.rollback()
       abort(422)
 
   '''
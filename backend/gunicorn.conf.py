@@ -0,0 +1,28 @@
+'''
+gunicorn settings for serving the app with gevent workers.
+Run from the repository root:
+
+    gunicorn -c backend/gunicorn.conf.py "backend.flaskr:create_app()"
+'''
+
+import os
+
+worker_class = 'gevent'
+workers = 4
+worker_connections = 100
+
+# Every worker keeps its own connection pool, so workers * (pool size + overflow)
+# must stay below PostgreSQL's max_connections (100 by default). Split
+# DB_MAX_CONNECTIONS evenly across the workers; greenlets beyond that wait for a
+# free connection.
+db_max_connections = int(os.environ.get('DB_MAX_CONNECTIONS', 80))
+os.environ.setdefault('DB_POOL_SIZE', str(db_max_connections // workers // 2))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(db_max_connections // workers // 2))
+
+
+def post_fork(server, worker):
+  '''
+  Let psycopg2 yield to other greenlets while a query is in flight.
+  '''
+  from psycogreen.gevent import patch_psycopg
+  patch_psycopg()
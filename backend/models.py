@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, DDL, create_engine, event, text
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -27,11 +27,16 @@ Question
 '''
 class Question(db.Model):
   __tablename__ = 'questions'
+  __table_args__ = (
+    Index('ix_question_tsv', text("to_tsvector('english', question)"), postgresql_using='gin'),
+    Index('ix_question_trgm', 'question', postgresql_using='gin', postgresql_ops={'question': 'gin_trgm_ops'}),
+    Index('ix_questions_cat_id', 'category', 'id'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -63,6 +68,11 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+'''
+the trigram index on questions.question needs the pg_trgm extension
+'''
+event.listen(Question.__table__, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
 '''
 Category
 
@@ -1,7 +1,5 @@
 import os
 import unittest
-import json
-from flask_sqlalchemy import SQLAlchemy
 
 from backend.flaskr import create_app
 from backend.models import setup_db, Question, Category
@@ -10,22 +8,16 @@ from backend.models import setup_db, Question, Category
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
-    def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.db_test_user = 'postgres'
-        self.db_password = 'root'
-        self.database_name = "trivia"
-        self.database_path = "postgres://{}:{}@{}/{}".format(self.db_test_user, self.db_password,'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+    @classmethod
+    def setUpClass(cls):
+        """Define test variables and initialize app once for all tests."""
+        cls.app = create_app({'CACHE_TYPE': 'NullCache'})
+        cls.client = cls.app.test_client
+        cls.db_test_user = 'postgres'
+        cls.db_password = 'root'
+        cls.database_name = "trivia"
+        cls.database_path = "postgres://{}:{}@{}/{}".format(cls.db_test_user, cls.db_password,'localhost:5432', cls.database_name)
+        setup_db(cls.app, cls.database_path)
     
     def tearDown(self):
         """Executed after reach test"""
@@ -37,7 +29,7 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_paginated_questions(self):
         res = self.client().get('/questions')
-        data = json.loads(res.data)
+        data = res.get_json()
 
         total_questions = len(Question.query.all())
 
@@ -48,9 +40,31 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['categories'])
 
 
+    def test_paginated_questions_after_cursor(self):
+        first_page = self.client().get('/questions').get_json()
+        res = self.client().get('/questions?after_id={}'.format(first_page['next_cursor']))
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['questions'])
+        self.assertTrue(all(question['id'] > first_page['next_cursor'] for question in data['questions']))
+
+
+    def test_next_cursor_is_none_on_last_page(self):
+        total_questions = len(Question.query.all())
+        last_page = (total_questions - 1) // 10 + 1
+        res = self.client().get('/questions?page={}'.format(last_page))
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        self.assertEqual(data['next_cursor'], None)
+
+
     def test_404_sent_requesting_questions_beyond_valid_page(self):
         res = self.client().get('/questions?page=100')
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -60,7 +74,7 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_get_categories(self):
         res  = self.client().get('/categories')
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
@@ -70,7 +84,7 @@ class TriviaTestCase(unittest.TestCase):
 
     def test_404_sent_requesting_invalid_category(self):
         res = self.client().get('/categories/10000')
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -84,21 +98,21 @@ class TriviaTestCase(unittest.TestCase):
         question_id = new_question.id
 
         res = self.client().delete('/questions/{}'.format(question_id))
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertEqual(data['deleted'], question_id)
 
 
-    def test_422_sent_deleting_nonexisting_question(self):
+    def test_404_sent_deleting_nonexisting_question(self):
         res = self.client().delete('/questions/{}'.format(12345))
-        data = json.loads(res.data)
+        data = res.get_json()
 
-        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
-        self.assertEqual(data['error'], 422)
-        self.assertEqual(data['message'], 'unprocessable')
+        self.assertEqual(data['error'], 404)
+        self.assertEqual(data['message'], 'resource not found')
 
 
     def test_add_new_question(self):
@@ -111,12 +125,14 @@ class TriviaTestCase(unittest.TestCase):
 
         question_before = len(Question.query.all())
         res = self.client().post('/questions', json=new_question)
-        data = json.loads(res.data)
+        data = res.get_json()
         questions_after = len(Question.query.all())
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(data['created'])
+        self.assertNotIn('questions', data)
+        self.assertEqual(data['total_questions'], questions_after)
         self.assertEqual(questions_after, question_before + 1)
 
 
@@ -129,7 +145,7 @@ class TriviaTestCase(unittest.TestCase):
 
         question_before = len(Question.query.all())
         res = self.client().post('/questions', json=new_question)
-        data = json.loads(res.data)
+        data = res.get_json()
         questions_after = len(Question.query.all())
 
         self.assertEqual(res.status_code, 422)
@@ -144,21 +160,63 @@ class TriviaTestCase(unittest.TestCase):
             "searchTerm": "autobiography"
         }
         res = self.client().post('/questions/search', json=searchjson)
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(data['questions'])
-        self.assertTrue(data['total_questions'])
+        self.assertEqual(data['total_questions'], len(data['questions']))
+        self.assertEqual(data['next_cursor'], None)
         self.assertEqual(data['current_category'], None)
 
 
+    def test_search_question_by_partial_word(self):
+        searchjson = {
+            "searchTerm": "autobio"
+        }
+        res = self.client().post('/questions/search', json=searchjson)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['questions'])
+        self.assertTrue(all('autobio' in question['question'].lower() for question in data['questions']))
+        self.assertEqual(data['total_questions'], len(data['questions']))
+        self.assertEqual(data['next_cursor'], None)
+
+
     def test_404_sent_search_question(self):
         searchjson = {
             "searchTerm": ""
         }
         res = self.client().post('/questions/search', json=searchjson)
-        data = json.loads(res.data)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 404)
+        self.assertEqual(data['message'], 'resource not found')
+
+
+    def test_404_sent_search_question_beyond_last_page(self):
+        searchjson = {
+            "searchTerm": "autobiography"
+        }
+        res = self.client().post('/questions/search?page=2', json=searchjson)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 404)
+        self.assertEqual(data['message'], 'resource not found')
+
+
+    def test_404_sent_search_question_with_invalid_page(self):
+        searchjson = {
+            "searchTerm": "autobiography"
+        }
+        res = self.client().post('/questions/search?page=0', json=searchjson)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -169,7 +227,7 @@ class TriviaTestCase(unittest.TestCase):
     def test_retrieve_questions_by_category(self):
         category_id = 1
         res = self.client().get('/categories/{}/questions'.format(category_id))
-        data = json.loads(res.data)
+        data = res.get_json()
 
         print(data)
 
@@ -183,7 +241,7 @@ class TriviaTestCase(unittest.TestCase):
     def test_404_sent_retrieve_questions_by_category(self):
         category_id = 10000
         res = self.client().get('/categories/{}/questions'.format(category_id))
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -200,19 +258,60 @@ class TriviaTestCase(unittest.TestCase):
             }
         }
         res = self.client().post('/quizzes', json=playjson)
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(data['question']['id'])
 
 
+    def test_play_quiz_excludes_previous_questions(self):
+        question_ids = [question.id for question in Question.query.filter(Question.category == 1).all()]
+        playjson = {
+            "previous_questions": question_ids[1:],
+            "quiz_category": {
+                "type": "Science",
+                "id": 1
+            }
+        }
+        res = self.client().post('/quizzes', json=playjson)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['id'], question_ids[0])
+
+        playjson['previous_questions'] = question_ids
+        res = self.client().post('/quizzes', json=playjson)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question'], None)
+
+
+    def test_422_sent_play_quiz_with_null_previous_questions(self):
+        playjson = {
+            "previous_questions": None,
+            "quiz_category": {
+                "type": "click",
+                "id": 0
+            }
+        }
+        res = self.client().post('/quizzes', json=playjson)
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 422)
+        self.assertEqual(data['message'], 'unprocessable')
+
+
     def test_422_sent_play_quiz(self):
         playjson = {
             "previous_questions": []
         }
         res = self.client().post('/quizzes', json=playjson)
-        data = json.loads(res.data)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 422)
         self.assertEqual(data['success'], False)